@@ -1,15 +1,156 @@
-from ftplib import FTP
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import errno
+import multiprocessing
 import os
+import queue
+import subprocess
 import tarfile
+import tempfile
+import threading
 import shutil
-from bs4 import BeautifulSoup
+from lxml import etree
 import re
-import pandas as pd
+import ahocorasick
+import pyarrow as pa
+import pyarrow.csv as pac
+import requests
+from requests.adapters import HTTPAdapter
 import spacy
-from spacy.matcher import PhraseMatcher, DependencyMatcher
+from spacy.matcher import DependencyMatcher
 from spacypdfreader.spacypdfreader import pdf_reader
 
-def download_pmc(dir, subdir, download_path):
+# Programs used to extract tar archives when installed
+_TAR = shutil.which("tar")
+_PIGZ = shutil.which("pigz")
+
+# PMC open access archive, served over HTTPS, and the archive links on its directory index pages
+_PMC_URL = "https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_package"
+_ARCHIVE_LINK_RE = re.compile(r'href="([^"/?]+\.tar\.gz)"')
+
+# Attribute holding the image file name of a graphic tag
+_XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# nxml parser for grab_spacy_text. Comments and processing instructions are kept in the tree: itertext skips
+# them, and the text on either side stays in separate chunks as it does with BeautifulSoup.
+_NXML_PARSER = etree.XMLParser(huge_tree=True, recover=True)
+# Inline citations and DOIs, which are left out of the text passed to spacy
+_CITATION_XPATH = etree.XPath('//xref[@ref-type="bibr"] | //object-id[@pub-id-type="doi"]')
+_STRIP_TAG = "_stripped"
+
+# Sentences containing any of the terms "Figure", "Fig", "figure", "fig", "Fig. " or "fig. " are kept by
+# grab_spacy_text. Every term contains "Fig" or "fig", so one search for either finds the same sentences.
+_FIG_TERM_RE = re.compile("[Ff]ig")
+
+# spacy model used by grab_spacy_text, loaded once per process by _get_nlp, and the trained components it leaves out
+_nlp = None
+_UNUSED_SPACY_PIPES = ["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+
+# Columns of figure_data.tsv and spacy_figure_data.tsv, and the pyarrow options used to read and write TSV files
+_FIGURE_COLUMNS = ["PMC ID", "Figure ID", "Figure Label", "Associated Image File", 
+    "Sentences Before", "Sentences After", "Caption Title", "Caption Text"]
+_FIGURE_SCHEMA = pa.schema([(column, pa.string()) for column in _FIGURE_COLUMNS])
+_SPACY_SCHEMA = pa.schema([("", pa.int64()), ("PMC ID", pa.string()), ("Sentences", pa.string())])
+_TSV_WRITE_OPTIONS = pac.WriteOptions(delimiter="\t")
+_TSV_PARSE_OPTIONS = pac.ParseOptions(delimiter="\t", newlines_in_values=True)
+_TSV_CONVERT_OPTIONS = pac.ConvertOptions(strings_can_be_null=True)
+_SENTENCES_CONVERT_OPTIONS = pac.ConvertOptions(strings_can_be_null=True, include_columns=["Sentences"])
+
+# Text cleaning patterns used by clean_text. _CLEAN_RE matches whitespace runs other than tabs
+# (including non-breaking spaces) and LaTeX commands in a single pass. A lone space is already clean,
+# so it is not matched and the replacement callback only runs where the text changes.
+# Citations are removed in a second pass, because they are only matched once whitespace is
+# collapsed and LaTeX commands inside them are gone.
+_CLEAN_RE = re.compile(r'(?P<ws>[^\S\t]{2,}|[^\S\t ])|(?P<latex>\\(?:documentclass\[[^\]]*\]\{[^\}]*\}|usepackage\{[^\}]*\}|setlength\{[^\}]*\}|begin\{[^\}]*\}|end\{[^\}]*\}|[a-zA-Z]+\{[^\}]*\}))')
+_CITATION_RE = re.compile(r'\((?:[A-Za-z\s\.\-]+(?:,|\set\sal\.,?|\sand\s[A-Za-z\s\.\-]+,?)\s?\d{4}(?:;?\s?)?)+\)')
+
+def _clean_match(match):
+    """
+    Replacement for _CLEAN_RE: whitespace collapses to a single space and LaTeX commands are removed.
+    """
+    return ' ' if match.lastgroup == 'ws' else ''
+
+def _text(element):
+    """
+    Returns all text inside an element, including the text of its children.
+    """
+    return "".join(element.itertext())
+
+def _clean(text):
+    """
+    Collapses line breaks and other runs of whitespace to single spaces and trims both ends.
+    """
+    return " ".join(text.split())
+
+def _document_text(xml_filepath):
+    """
+    Returns the text of an nxml file without inline citations or DOIs, with whitespace collapsed.
+    A file lxml cannot read (e.g. an empty one) has no text.
+    """
+    try:
+        root = etree.parse(xml_filepath, _NXML_PARSER).getroot()
+    except etree.XMLSyntaxError:
+        return ""
+    if root is None:
+        return ""
+    # Matches are renamed and then removed in one pass by strip_elements. The text after each one is kept,
+    # separated by a space as if it were still its own text node.
+    for element in _CITATION_XPATH(root):
+        element.tag = _STRIP_TAG
+        if element.tail:
+            element.tail = " " + element.tail
+    etree.strip_elements(root, _STRIP_TAG, with_tail=False)
+    return _clean(" ".join(root.itertext()))
+
+def _pmc_id(name):
+    """
+    Returns the folder name if it is a PMC ID (e.g. PMC12345), otherwise None.
+    """
+    return name if name.startswith("PMC") and name[3:].isdecimal() else None
+
+def _iter_pmc_records(root):
+    """
+    Yields (record, file_names) for each PMC record folder in root, where record is the os.DirEntry of the
+    folder and file_names lists the files directly inside it. Records are flat, so one scandir per record
+    is enough, and DirEntry type checks come from the directory listing without extra stat calls.
+    :param root: folder holding one subfolder per PMC record.
+    """
+    with os.scandir(root) as records:
+        for record in records:
+            if not record.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(record.path) as entries:
+                yield record, [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+
+def _pmc_session(max_workers):
+    """
+    Returns a requests session with one keep-alive connection per download worker, so files after the first
+    skip the TCP/TLS handshake.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers))
+    return session
+
+def _list_archives(session, directory_url):
+    """
+    Returns the names of the archives linked from a PMC directory index page.
+    """
+    response = session.get(directory_url)
+    response.raise_for_status()
+    return list(dict.fromkeys(_ARCHIVE_LINK_RE.findall(response.text)))
+
+def _download_file(session, url, downloaded_file_path):
+    """
+    Streams one file to disk.
+    """
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with open(downloaded_file_path, "wb") as f:
+            shutil.copyfileobj(response.raw, f, length=1 << 20)
+
+def download_pmc(dir, subdir, download_path, max_workers=8):
     """
     :params dir and subdir:
     The PMC open access archive is organized by two levels of directories, with each directory 
@@ -21,73 +162,193 @@ def download_pmc(dir, subdir, download_path):
    
     :param download_path:
     PMC directories will be downloaded and saved to the specified location for downstream processing.
+
+    :param max_workers:
+    Number of HTTPS connections used to download files in parallel.
     """
-    server = "ftp.ncbi.nlm.nih.gov"
-    server_directory = "/pub/pmc/oa_package/"
-    full_directory_path = os.path.join(server_directory, dir, subdir)
+    directory_url = f"{_PMC_URL}/{dir}/{subdir}/"
 
     # Create a local folder to store the downloads
     if not os.path.exists(download_path):
         os.makedirs(download_path)
 
-    # Connect to FTP server
-    ftp = FTP(server)
-    ftp.login()
-
-    # Change to the target directory
-    ftp.cwd(full_directory_path)
-
-    # List files in the directory
-    files = ftp.nlst()  # Get list of all files in the directory
+    session = _pmc_session(max_workers)
+    files = _list_archives(session, directory_url)
 
     print(f"Found {len(files)} files. Starting download...")
 
-    # Download each file
-    for file in files:
-        downloaded_file_path = os.path.join(download_path, file)
-        
-        # Download the file in binary mode
-        with open(downloaded_file_path, "wb") as f:
-            ftp.retrbinary(f"RETR {file}", f.write)
-        
+    def fetch(file):
+        _download_file(session, directory_url + file, os.path.join(download_path, file))
         print(f"Downloaded: {file}")
 
-    # Close FTP connection
-    ftp.quit()
+    # Download files concurrently over the pooled connections
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(fetch, files))
+
+    session.close()
 
     print(f"Directory {dir}/{subdir} downloaded successfully!")
 
-def uncompress_tar(download_path):
+def _extract_tar(compressed_filepath, uncompressed_filepath):
+    """
+    Extracts a single tar archive. Runs in a worker process for uncompress_tar.
+    The system tar is used when available (decompressing with pigz if it is installed), otherwise the
+    archive is streamed through the tarfile module. The archive is unpacked into its own temporary folder
+    and its contents are renamed into place afterwards, so a corrupted archive leaves nothing behind.
+    :return: names of the files and folders extracted into uncompressed_filepath, or None if the archive is corrupted.
+    """
+    # Let the kernel read the archive ahead of the decompressor (Linux only)
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(compressed_filepath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    # Hidden folder on the same filesystem, so moving its contents is a rename
+    staging_path = tempfile.mkdtemp(prefix=f".{os.path.basename(compressed_filepath)}-", dir=uncompressed_filepath)
+    try:
+        try:
+            if _PIGZ and _TAR:
+                subprocess.run([_TAR, "--use-compress-program", _PIGZ, "-xf", compressed_filepath, "-C", staging_path], check=True)
+            elif _TAR:
+                subprocess.run([_TAR, "-xzf", compressed_filepath, "-C", staging_path], check=True)
+            else:
+                # Stream mode reads the archive front to back without seeking back in the gzip stream
+                with open(compressed_filepath, "rb", buffering=1 << 20) as fileobj:
+                    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+                        tar.extractall(path = staging_path, filter="data")
+        except (subprocess.CalledProcessError, tarfile.TarError, EOFError):
+            return None
+
+        names = []
+        with os.scandir(staging_path) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                # A record extracted by an earlier run is replaced
+                _move(entry.path, os.path.join(uncompressed_filepath, entry.name))
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    return names
+
+def uncompress_tar(download_path, max_workers=None):
     """
     Uncompresses all tar archives in the provided folder and removes empty archives.
     :param download_path: path to downloaded PMC directory
+    :param max_workers: number of archives extracted in parallel. Defaults to the number of CPUs.
     """
-    tar_list = os.listdir(download_path)
     uncompressed_filepath = os.path.join(download_path, "Uncompressed")
 
     os.makedirs(uncompressed_filepath, exist_ok=True)
-    for item in tar_list: # item = compressed archive
-        compressed_filepath = os.path.join(download_path, item)
-        if item.endswith(".tar.gz"):
-            if os.path.getsize(compressed_filepath) > 0:
-                if os.path.isfile(compressed_filepath): 
-                    with tarfile.open(compressed_filepath, "r") as tar:
-                        try:
-                            tar.extractall(path = uncompressed_filepath)
-                            print(f'{item} has been uncompressed succesfully.')
-                            os.remove(compressed_filepath)
-                            print(f'{item} archive has been removed.')
-                        except EOFError:
-                            print("Corrupted tar archive. Moving to next file.")
-                else:
-                    pass # skips directories 
+    archives = []
+    compressed_filepaths = []
+    # DirEntry reuses the file type returned by the directory listing, so only sizes need a stat call
+    with os.scandir(download_path) as entries:
+        for entry in entries: # entry = compressed archive
+            if entry.name.endswith(".tar.gz"):
+                if entry.is_file():
+                    if entry.stat().st_size > 0:
+                        archives.append(entry.name)
+                        compressed_filepaths.append(entry.path)
+                    else:
+                        os.remove(entry.path) # Removes empty files
+                elif entry.is_dir() and entry.stat().st_size == 0:
+                    os.rmdir(entry.path) # Removes empty directories
             else:
-                if os.path.isfile(compressed_filepath):
-                    os.remove(compressed_filepath) # Removes empty files
-                elif os.path.isdir(compressed_filepath):
-                    os.rmdir(compressed_filepath) # Removes empty directories
-        else:
+                pass
+
+    # Archives are independent, so they are extracted in parallel
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_extract_tar, compressed_filepaths, repeat(uncompressed_filepath))
+        for item, compressed_filepath, extracted in zip(archives, compressed_filepaths, results):
+            if extracted is not None:
+                print(f'{item} has been uncompressed succesfully.')
+                os.remove(compressed_filepath)
+                print(f'{item} archive has been removed.')
+            else:
+                print("Corrupted tar archive. Moving to next file.")
+
+def _has_figure(nxml_path):
+    """
+    Returns True if the nxml file contains a fig tag. Parsing stops at the first one found.
+    A file lxml cannot read at all (e.g. an empty one) has no figures.
+    """
+    with open(nxml_path, "rb") as xml_file:
+        try:
+            for _ in etree.iterparse(xml_file, events=("start",), tag="fig", huge_tree=True, recover=True):
+                return True
+        except etree.XMLSyntaxError:
             pass
+    return False
+
+def _move(source, destination):
+    """
+    Moves a file or folder with a single rename. Data is only copied when the destination is on another filesystem.
+    A folder left at the destination by an earlier run is replaced, since a rename cannot overwrite a non-empty folder.
+    """
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        shutil.rmtree(destination)
+    try:
+        os.replace(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        shutil.move(source, destination)
+
+def _find_nxml(record_id, pmc_record_contents):
+    """
+    Returns the name of the nxml file of a record that also contains images, or None if the record has no images or no nxml file.
+    :param record_id: PMC ID of the record, used in progress messages.
+    :param pmc_record_contents: names of the files in the record folder.
+    """
+    # Check for images
+    images = (".png", ".jpg", ".gif")
+    if not any(file.endswith(images) for file in pmc_record_contents):
+        print(f"No images associated with {record_id}")
+        return None
+    print(f"Image found in record {record_id}")
+
+    # Find nxml file
+    nxml_file = next((file for file in pmc_record_contents if file.endswith(".nxml")), None)
+    if nxml_file:
+        print(f"XML file found in record {record_id}")
+    else:
+        print(f"No XML associated with {record_id}")
+    return nxml_file
+
+def _sort_records(download_path, downstream_processing, to_remove):
+    """
+    Moves viable records from Uncompressed to Sorted and removes the rest.
+    :param download_path: filepath for the parent folder that holds the PMC folders to process.
+    :param downstream_processing: names of the record folders to keep.
+    :param to_remove: names of the record folders to remove.
+    """
+    uncompressed_filepath = os.path.join(download_path, "Uncompressed")
+
+    # Sort files into a folder for downstream analysis 
+    output_filepath = os.path.join(download_path, "Sorted")
+    os.makedirs(output_filepath, exist_ok=True)  # Ensure destination folder exists
+    
+    def move(item):
+        source2 = os.path.join(uncompressed_filepath, item)
+        destination = os.path.join(output_filepath, item)
+        try:
+            _move(source2, destination)
+        except FileNotFoundError:
+            print(f"Warning: Source folder {source2} not found, skipping move.")
+
+    def remove(item):
+        source4 = os.path.join(uncompressed_filepath, item)
+        try:
+            shutil.rmtree(source4)
+            print(f"{item} does not include sufficient data for processing and has been removed.")
+        except FileNotFoundError:
+            print(f"Warning: Directory {source4} not found, skipping removal.")
+
+    # Renames and the unlink/rmdir calls behind rmtree release the GIL, so they run in a thread pool
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(move, downstream_processing))
+        list(executor.map(remove, to_remove))
 
 def sort_data(download_path):
     """
@@ -98,308 +359,403 @@ def sort_data(download_path):
     downstream_processing = []
     to_remove = [] 
 
-    for root, dirs, files in os.walk(download_path):
-        parent_folder = os.path.basename(os.path.dirname(root))  
-        for subdir in dirs:  # each subdir is one PMC record
-            subdir_path = os.path.join(root, subdir)
-            for file_info in os.walk(subdir_path):  # Looks at all files in the PMC record dir
-                pmc_record_path = file_info[0]
-                pmc_record_contents = file_info[2]  # List of files in the folder
-                
-                # Extract PMC ID
-                record_id_match = re.match(r".*/(PMC\d+)$", pmc_record_path)
-                record_id = record_id_match.group(1) if record_id_match else None
-                if not record_id:
-                    continue  # Skip if record ID is not found
-                
-                # Check for images
-                images = (".png", ".jpg", ".gif")
-                if any(file.endswith(images) for file in pmc_record_contents):
-                    print(f"Image found in record {record_id}")
-                    
-                    # Find nxml file
-                    nxml_file = next((file for file in pmc_record_contents if file.endswith(".nxml")), None)
-                    if nxml_file:
-                        print(f"XML file found in record {record_id}")
-                        nxml_path = os.path.join(pmc_record_path, nxml_file)
-                        
-                        # Read XML content
-                        with open(nxml_path, "r", encoding="utf-8") as xml_file:
-                            content = xml_file.read()
-                            soup = BeautifulSoup(content, features="xml")
-                            
-                            # Check for figure data
-                            figures_present = soup.find_all("fig")
-                            if figures_present:
-                                print(f"Figure data found in XML contents for record {record_id}")
-                                downstream_processing.append(record_id)
-                            else:
-                                print(f"No figure data in {record_id}")
-                                to_remove.append(record_id)
-                    else:
-                        print(f"No XML associated with {record_id}")
-                        to_remove.append(record_id)
+    uncompressed_filepath = os.path.join(download_path, "Uncompressed")
+    for record, pmc_record_contents in _iter_pmc_records(uncompressed_filepath):  # each subdir is one PMC record
+        # Extract PMC ID
+        record_id = _pmc_id(record.name)
+        if not record_id:
+            continue  # Skip if record ID is not found
+        
+        nxml_file = _find_nxml(record_id, pmc_record_contents)
+        if not nxml_file:
+            to_remove.append(record_id)
+        # Check for figure data
+        elif _has_figure(os.path.join(record.path, nxml_file)):
+            print(f"Figure data found in XML contents for record {record_id}")
+            downstream_processing.append(record_id)
+        else:
+            print(f"No figure data in {record_id}")
+            to_remove.append(record_id)
+
+    _sort_records(download_path, downstream_processing, to_remove)
+
+def _release(elem):
+    """
+    Frees an element that iterparse has finished with, along with the siblings before it.
+    """
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def _parse_figures(xml_filepath):
+    """
+    Streams an nxml file with iterparse and returns its figure data as a dict of columns, with one
+    entry per figure tag in each column. Paragraphs and figures are cleared once they have been read and
+    their earlier siblings are dropped from the tree. Other elements (tables, reference lists, front matter)
+    are still built by iterparse and stay in memory until the file is done.
+    :param xml_filepath: path to the nxml file of one PMC record.
+    :return: the figure columns, and whether the file has a fig tag (the check sort_data makes with _has_figure).
+    A file lxml cannot read at all (e.g. an empty one) has no figures.
+    """
+    figures = {column: [] for column in _FIGURE_COLUMNS if column != "PMC ID"}
+    ref_text = {}  # rid -> (sentences before, sentences after) for the first xref inside a paragraph
+    claimed = set()  # rids already bound to the paragraph around their first xref, in document order
+    awaiting_next = {}  # parent element -> rids still waiting for the next sibling paragraph
+    para_refs = []  # rids claimed by each open paragraph, innermost paragraph last
+    open_figs = 0
+    has_fig = False
+
+    context = etree.iterparse(xml_filepath, events=("start", "end"), tag=("p", "xref", "fig", "Fig"), huge_tree=True, recover=True)
+    try:
+        for event, elem in context:
+            if event == "start":
+                if elem.tag == "p":
+                    para_refs.append([])
+                elif elem.tag != "xref":
+                    open_figs += 1
+                continue
+
+            if elem.tag == "xref":
+                ref_id = elem.get("rid")
+                # The first xref inside a paragraph binds the rid to its nearest enclosing paragraph, even
+                # when a nested paragraph with the same rid closes first. xrefs outside paragraphs are skipped.
+                if ref_id and para_refs:
+                    ref_id = _clean(ref_id)
+                    if ref_id not in claimed:
+                        claimed.add(ref_id)
+                        para_refs[-1].append(ref_id)
+
+            elif elem.tag == "p":
+                refs = para_refs.pop()
+
+                # This paragraph is the text after any xrefs found in its previous sibling paragraph.
+                # Its text is only built when one of them, or one of its own xrefs, needs it.
+                parent = elem.getparent()
+                previous_refs = awaiting_next.pop(parent, ())
+                if refs or previous_refs:
+                    text = _clean(_text(elem))
+                    for ref_id in previous_refs:
+                        ref_text[ref_id] = (ref_text[ref_id][0], text)
+
+                    for ref_id in refs:
+                        ref_text[ref_id] = (text, "No text after")
+                if refs:
+                    awaiting_next[parent] = refs
+
+                # Paragraphs nested in a figure or another paragraph are still needed by their ancestor
+                if not para_refs and open_figs == 0:
+                    _release(elem)
+
+            else:  # fig or Fig
+                open_figs -= 1
+                has_fig = has_fig or elem.tag == "fig"
+                figure_id = _clean(elem.get("id", ""))
+
+                # Element.iter matches tag names in C, without XPath or regex evaluation
+                label_tag = next(elem.iter("label"), None)
+                if label_tag is not None:
+                    figure_label = _clean(_text(label_tag))
                 else:
-                    print(f"No images associated with {record_id}")
-                    to_remove.append(record_id)
+                    figure_label = "No figure label"
 
-    # Sort files into a folder for downstream analysis 
-    output_filepath = os.path.join(download_path, "Sorted")
-    os.makedirs(output_filepath, exist_ok=True)  # Ensure destination folder exists
-    
-    for item in downstream_processing:
-        source = os.path.join(download_path, "Uncompressed")
-        source2 = os.path.join(source, item)
-        destination = os.path.join(output_filepath, item)
-        if os.path.exists(source2):
-            shutil.move(source2, destination)
+                image_ref_tag = next(elem.iter("graphic"), None)
+                if image_ref_tag is not None:
+                    associated_image = image_ref_tag.get(_XLINK_HREF)
+                else:
+                    associated_image = "Not found"
+
+                caption_title_text = "No caption title"
+                caption_text_text = "No caption text"
+                # Extract caption data 
+                for caption in elem.iter("caption", "Caption"):
+                    caption_title = caption.find(".//title")
+                    caption_title_text = _clean(_text(caption_title)) if caption_title is not None else "No caption title"
+                    caption_text = caption.find(".//p")
+                    caption_text_text = _clean(_text(caption_text)) if caption_text is not None else "No caption text"
+
+                figures["Figure ID"].append(figure_id)
+                figures["Figure Label"].append(figure_label)
+                figures["Associated Image File"].append(associated_image)
+                figures["Caption Title"].append(caption_title_text)
+                figures["Caption Text"].append(caption_text_text)
+
+                # A figure inside a paragraph is part of that paragraph's text
+                if not para_refs and open_figs == 0:
+                    _release(elem)
+    except etree.XMLSyntaxError:
+        return {column: [] for column in figures}, False
+
+    # xrefs can appear after the figure they point to, so sentences are filled in at the end.
+    # A figure whose xrefs are all outside paragraphs counts as having no xref.
+    for figure_id in figures["Figure ID"]:
+        if figure_id in ref_text:
+            sentences_before, sentences_after = ref_text[figure_id]
         else:
-            print(f"Warning: Source folder {source} not found, skipping move.")
+            sentences_before, sentences_after = "No xref found", "No xref found"
+        figures["Sentences Before"].append(sentences_before)
+        figures["Sentences After"].append(sentences_after)
 
+    return figures, has_fig
 
-    for item in to_remove:
-        source3 = os.path.join(download_path, "Uncompressed")
-        source4 = os.path.join(source3, item)
-        
-        if os.path.exists(source4):
-            shutil.rmtree(source4)
-            print(f"{item} does not include sufficient data for processing and has been removed.")
-        else:
-            print(f"Warning: Directory {source4} not found, skipping removal.")
+def _extract_one(pmc_record_path, record_id, file_list):
+    """
+    Extracts figure data from a single PMC record. Runs in a worker process for grab_figure_data.
+    :param pmc_record_path: filepath for one PMC record folder.
+    :param record_id: PMC ID of the record.
+    :param file_list: names of the files in the record folder.
+    :return: a dict mapping each figure_data.tsv column to a list of values, one per figure in the record,
+    and the set of nxml file names that contain a fig tag.
+    """
 
-def grab_figure_data(download_path):
+    figures = {column: [] for column in _FIGURE_COLUMNS}
+    fig_files = set()
+    for item in file_list:
+        if item.endswith(".nxml"): # Process XML file
+            xml_filepath = os.path.join(pmc_record_path, item)
+            print(f"Processing file: {xml_filepath}")
+
+            parsed, has_fig = _parse_figures(xml_filepath)
+            for column, values in parsed.items():
+                figures[column].extend(values)
+            if has_fig:
+                fig_files.add(item)
+    figures["PMC ID"] = [record_id] * len(figures["Figure ID"])
+    return figures, fig_files
+
+def grab_figure_data(download_path, max_workers=None):
     """
     Extracts figure captions from all PMC records in the provided folder.
     :param download_path: filepath for the parent folder that holds the PMC folders to process.
+    :param max_workers: number of processes used to parse records in parallel. Defaults to the number of CPUs.
     :return: a .tsv file with figure captions for each PMC record.
     """
 
     input_filepath = os.path.join(download_path, "Sorted")
     output_filepath = download_path
     output_file = os.path.join(download_path, "figure_data.tsv")
-   
-    all_figures = []
-    for root, dirs, files in os.walk(input_filepath):  
-        # print(f"Processing directory: {root}")  # Print the directory being processed
-
-        for subdir in dirs:  # each subdir is one PMC record
-            # print(f"Processing subdirectory: {subdir}")
-            subdir_path = os.path.join(root, subdir)
-
-            for file in os.walk(subdir_path): # Every directory is 1 PMC record
-                # Initialize lists
-                
-                pmc_record_path = file[0]
-                file_list = file[2] 
-                image_list = []
-                figure_ids = []
-                associated_images = []
-                figure_labels = []
-                sentences_before = []
-                sentences_after = []
-                direct_ref_text = []
-                caption_titles = []
-                caption_texts = []
-                raw_image_names = []
-
-                # Extract record ID
-                record_id = re.match(r".*/(PMC\d+)$", pmc_record_path)
-                if record_id:
-                    record_id = record_id.group(1)
-                
-
-                for item in file_list:
-                    if item.endswith(".nxml"): # Process XML file
-                        # Read the content of the XML file
-                        xml_filepath = os.path.join(file[0], item)
-                        print(f"Processing file: {xml_filepath}")
-                        
-                        with open(xml_filepath, "r", encoding="utf-8") as xml_file:
-                            content = xml_file.read()
-                            soup = BeautifulSoup(content, features="xml")
-
-                            # Global search for all figure tags
-                            figures = soup.find_all(re.compile(r"^[Ff]ig$"))
-                            for figure in figures:
-                                # Extract figure data
-                                figure_id = figure.get("id").strip().replace("\n", " ")
-                                
-                                label_tag = figure.find("label")
-                                if label_tag:
-                                    figure_label = label_tag.text.strip().replace("\n", " ")
-                                else:
-                                    figure_label = "No figure label"
-
-                                image_ref_tag = figure.find("graphic")
-                                if image_ref_tag:
-                                    associated_image = image_ref_tag.get("xlink:href")
-                                else:
-                                    associated_image = "Not found"
-                                
-                                xrefs_in_doc = soup.find_all("xref") # Returns list of all xrefs
-                                for ref in xrefs_in_doc:
-                                    if ref:
-                                        ref_id = ref.get('rid')
-                                        if ref_id:
-                                            ref_id = ref_id.strip().replace("\n", " ")
-                                            if ref_id == figure_id :
-                                                before_text = ref.find_parent('p')
-                                                if before_text:
-                                                    after_text = before_text.find_next_sibling('p')
-                                                else:
-                                                    sentences_before = "No text before"
-
-                                                if before_text and after_text:
-                                                    sentences_before = before_text.get_text().strip().replace("\n", " ")
-                                                    sentences_after = after_text.get_text().strip().replace("\n", " ")
-                                                    break
-                                                elif before_text:
-                                                    sentences_before = before_text.get_text().strip().replace("\n", " ")
-                                                    sentences_after = "No text after"
-                                                    break
-                                                else:
-                                                    sentences_after
-                                            else:
-                                                sentences_before = "No text before"
-                                        else:
-                                            sentences_before = "No xref found"
-                                            sentences_after = "No xref found"
-                                else:
-                                    sentences_before = "No xref found"
-                                    sentences_after = "No xref found"
-                                
-                                xrefs_in_doc = soup.find_all("xref") # Returns list of all xrefs
-                                for ref in xrefs_in_doc:
-                                    if ref:
-                                        ref_id = ref.get('rid')
-                                        if ref_id:
-                                            ref_id = ref_id.strip().replace("\n", " ")
-                                            if ref_id == figure_id :
-                                                parent = ref.find_parent('p')
-                                        else:
-                                            ref_id = "No xref found"        
-                                    else:
-                                        ref_id = "No xref found"
-
-                                caption_title_text = "No caption title"
-                                caption_text_text = "No caption text"
-                                # Extract caption data 
-                                captions = figure.find_all(re.compile(r"^[Cc]aption$"))
-                                for caption in captions:
-                                    caption_title = caption.find("title")
-                                    caption_title_text = caption_title.text.strip().replace("\n", " ") if caption_title else "No caption title"
-                                    caption_text = caption.find("p")
-                                    caption_text_text = caption_text.text.strip().replace("\n", " ") if caption_text else "No caption text"
-                                
-                                # Export to dictionary (one dict per figure)
-                                all_figures.append({
-                                    "PMC ID": record_id,
-                                    "Figure ID": figure_id,
-                                    "Figure Label": figure_label,
-                                    "Associated Image File": associated_image,
-                                    "Sentences Before": sentences_before,
-                                    "Sentences After": sentences_after,
-                                    "Caption Title": caption_title_text,
-                                    "Caption Text": caption_text_text
-                                })
-
-    df = pd.DataFrame(all_figures, columns=[
-            "PMC ID", "Figure ID", "Figure Label", "Associated Image File", 
-            "Sentences Before", "Sentences After", "Caption Title", "Caption Text"
-        ])
-
-    # Export data
-    
+
+    # Each subdir is one PMC record. The listing is taken once here, so workers only open the nxml files.
+    record_paths, record_ids, file_lists = [], [], []
+    for record, file_list in _iter_pmc_records(input_filepath):
+        record_paths.append(record.path)
+        record_ids.append(_pmc_id(record.name))
+        file_lists.append(file_list)
+
     output_csv = os.path.join(output_filepath, output_file)
     os.makedirs(output_filepath, exist_ok=True)
 
-    df.to_csv(output_csv, sep='\t', index=False, encoding="utf-8")
+    # Records are independent, so they are parsed across processes in batches of up to 32,
+    # while small folders are still spread across every worker.
+    # Figures are written batch by batch as they arrive, so memory does not grow with the folder size.
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, min(32, -(-len(record_paths) // workers)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+            pac.CSVWriter(output_csv, _FIGURE_SCHEMA, write_options=_TSV_WRITE_OPTIONS) as writer:
+        for figures, _ in executor.map(_extract_one, record_paths, record_ids, file_lists, chunksize=chunksize):
+            if figures["Figure ID"]:
+                writer.write_table(pa.Table.from_pydict(figures, schema=_FIGURE_SCHEMA))
+
+    print(f"Extraction complete. CSV saved to {output_csv}")
+
+def _process_record(pmc_record_path, record_id, file_list):
+    """
+    Checks that a PMC record is viable and extracts its figure data in the same pass over the nxml.
+    A record is viable under the same rule as sort_data: it has images, and the first nxml file found has a fig tag.
+    Runs in a worker process for process_records and run_pipeline.
+    :param pmc_record_path: filepath for one PMC record folder.
+    :param record_id: PMC ID of the record.
+    :param file_list: names of the files in the record folder.
+    :return: the record's figure data as returned by _extract_one, or None if the record is not viable.
+    """
+    nxml_file = _find_nxml(record_id, file_list)
+    if not nxml_file:
+        return None
+
+    figures, fig_files = _extract_one(pmc_record_path, record_id, file_list)
+    if nxml_file not in fig_files:
+        print(f"No figure data in {record_id}")
+        return None
+    print(f"Figure data found in XML contents for record {record_id}")
+    return figures
+
+def _write_and_sort_records(download_path, results):
+    """
+    Writes the figure data of each viable record to figure_data.tsv as results arrive, then moves viable records
+    to Sorted and removes the rest. Shared by process_records and run_pipeline.
+    :param download_path: filepath for the parent folder that holds the PMC folders to process.
+    :param results: iterable of (record ID, figure data or None) pairs, as returned by _process_record.
+    """
+    output_csv = os.path.join(download_path, "figure_data.tsv")
+
+    downstream_processing = []
+    to_remove = []
+    with pac.CSVWriter(output_csv, _FIGURE_SCHEMA, write_options=_TSV_WRITE_OPTIONS) as writer:
+        for record_id, figures in results:
+            if figures is None:
+                to_remove.append(record_id)
+            else:
+                downstream_processing.append(record_id)
+                writer.write_table(pa.Table.from_pydict(figures, schema=_FIGURE_SCHEMA))
+
     print(f"Extraction complete. CSV saved to {output_csv}")
+    _sort_records(download_path, downstream_processing, to_remove)
 
-def grab_spacy_text(download_path):
+def process_records(download_path, max_workers=None):
+    """
+    Runs sort_data and grab_figure_data in a single pass, so each nxml file is parsed once. Viable records are
+    moved to the Sorted folder, the rest are removed, and their figure data is written to figure_data.tsv.
+    :param download_path: filepath for the parent folder that holds the PMC folders to process.
+    :param max_workers: number of processes used to parse records in parallel. Defaults to the number of CPUs.
+    :return: a .tsv file with figure captions for each viable PMC record.
+    """
+    uncompressed_filepath = os.path.join(download_path, "Uncompressed")
+
+    record_ids, record_paths, file_lists = [], [], []
+    for record, file_list in _iter_pmc_records(uncompressed_filepath):  # each subdir is one PMC record
+        record_id = _pmc_id(record.name)
+        if not record_id:
+            continue  # Skip if record ID is not found
+        record_ids.append(record_id)
+        record_paths.append(record.path)
+        file_lists.append(file_list)
+
+    # Records are parsed in batches of up to 32, while small folders are still spread across every worker
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, min(32, -(-len(record_paths) // workers)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_process_record, record_paths, record_ids, file_lists, chunksize=chunksize)
+        _write_and_sort_records(download_path, zip(record_ids, results))
+
+def _get_nlp():
+    """
+    Returns the spacy model, loading it on first use. Each worker process loads its own copy instead of
+    receiving a pickled model from the parent. Only the tokenizer and a rule-based sentencizer are kept,
+    since grab_spacy_text uses nothing but sentence boundaries.
+    """
+    global _nlp
+    if _nlp is None:
+        _nlp = spacy.load("en_core_web_sm", exclude=_UNUSED_SPACY_PIPES)
+        _nlp.add_pipe("sentencizer")
+    return _nlp
+
+def _iter_record_texts(records):
+    """
+    Yields (text, subdir) for each nxml file in the given records, in the form expected by nlp.pipe(as_tuples=True).
+    :param records: list of (record path, record folder name, file names) tuples.
+    """
+    for pmc_record_path, subdir, filenames in records:
+        print(f"Processing subdirectory: {subdir}")
+        for filename in filenames:
+            if filename.endswith(".nxml"):
+                yield _document_text(os.path.join(pmc_record_path, filename)), subdir
+
+def _spacy_sentences(records):
+    """
+    Extracts the sentences that mention a figure from a batch of PMC records. Runs in a worker process for grab_spacy_text.
+    :param records: list of (record path, record folder name, file names) tuples. The folder name is stored as the
+    PMC ID of each sentence.
+    :return: a list of [PMC ID, sentence] rows.
+    """
+    nlp = _get_nlp()
+
+    sentence_data = []
+    # Documents are run through the pipeline in batches
+    docs = nlp.pipe(_iter_record_texts(records), as_tuples=True, batch_size=32)
+    for doc, subdir in docs:
+        sentences = list(doc.sents)
+
+        for i, sentence in enumerate(sentences):
+            if _FIG_TERM_RE.search(sentence.text):
+                # Include next sentence if sentence ends in "Fig."
+                if sentence.text.strip().endswith("Fig."):
+                    next_sentence = sentences[i + 1].text if i + 1 < len(sentences) else ""
+                    sentence_data.append([subdir, sentence.text + " " + next_sentence])
+                    
+                else:
+                    sentence_data.append([subdir, sentence.text])
+    return sentence_data
+
+def grab_spacy_text(download_path, max_workers=None):
+    """
+    Extracts sentences that mention a figure from all PMC records in the provided folder.
+    :param download_path: filepath for the parent folder that holds the PMC folders to process.
+    :param max_workers: number of processes used to run spacy on records in parallel. Defaults to the number of CPUs.
+    :return: a .tsv file with the figure sentences of each PMC record.
+    """
     input_filepath = os.path.join(download_path, "Sorted")
     output_filepath = download_path
     output_file = os.path.join(download_path, "spacy_figure_data.tsv")
-    
-    sentence_data = []
-    nlp = spacy.load("en_core_web_sm")
-    terms = ["Figure", "Fig", "figure", "fig", "fig. ", "Fig. "]
-    matcher = PhraseMatcher(nlp.vocab)
-
-
-    for root, dirs, files in os.walk(input_filepath):  
-        # print(f"Processing directory: {root}")  # Print the directory being processed
-
-        for subdir in dirs:  # each subdir is one PMC record
-            print(f"Processing subdirectory: {subdir}")
-            subdir_path = os.path.join(root, subdir)
-            for dirpath, _, filenames in os.walk(subdir_path):
-                for filename in filenames:
-                    item_path = os.path.join(dirpath, filename)
-                    if item_path.endswith(".nxml"):
-                        with open(item_path, "r") as file: 
-                            
-                            soup = BeautifulSoup(file, "xml")
-                            for xref in soup.find_all("xref", {"ref-type": "bibr"}): # Remove inline citations 
-                                xref.decompose()
-                            for id in soup.find_all("object-id", {"pub-id-type" : "doi"}):
-                                id.decompose()
-                            text = soup.get_text(separator = ' ')
-                            text = re.sub(r'\s+', ' ', text).strip()
-                            
-                            
-                            doc = nlp(text)
-                            sentences = list(doc.sents)
-
-                            for i, sentence in enumerate(sentences):
-                                if any(term in sentence.text for term in terms):      
-                                    # Include next sentence if sentence ends in "Fig."
-                                    if sentence.text.strip().endswith("Fig."):
-                                        next_sentence = sentences[i + 1].text if i + 1 < len(sentences) else ""
-                                        sentence_data.append([subdir, sentence.text + " " + next_sentence])
-                                        
-                                    else:
-                                        sentence_data.append([subdir, sentence.text])
-                                        
-                                                    
-    df = pd.DataFrame(sentence_data, columns=["PMC ID", "Sentences"])
-    df.to_csv(output_file, sep="\t")
+
+    # each subdir is one PMC record
+    records = [(record.path, record.name, filenames) for record, filenames in _iter_pmc_records(input_filepath)]
+
+    # Records are split into batches of up to 32 so each worker can batch them through spacy,
+    # while small folders are still spread across every worker
+    workers = max_workers or os.cpu_count() or 1
+    batch_size = max(1, min(32, -(-len(records) // workers)))
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+    # spacy holds the GIL while it runs, so batches are processed across processes.
+    # Sentences are written batch by batch, after the row number column that DataFrame.to_csv used to write.
+    row_count = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+            pac.CSVWriter(output_file, _SPACY_SCHEMA, write_options=_TSV_WRITE_OPTIONS) as writer:
+        for rows in executor.map(_spacy_sentences, batches):
+            if not rows:
+                continue
+            pmc_ids, sentences = zip(*rows)
+            row_numbers = range(row_count, row_count + len(rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(row_numbers, pa.int64()), pa.array(pmc_ids, pa.string()),
+                pa.array(sentences, pa.string())], schema=_SPACY_SCHEMA))
+            row_count += len(rows)
+
     print(f"Spacy text extracted: {output_file}")
 
 def combine_dataframes(download_path):
     df1_path = os.path.join(download_path, "figure_data.tsv")
     df2_path = os.path.join(download_path, "spacy_figure_data.tsv")
     df_combined_path = os.path.join(download_path, "combined_figure_data.tsv")
-    df1 = pd.read_csv(df1_path, sep="\t")
-    df2 = pd.read_csv(df2_path, sep="\t")
-
-
-
-
-    merged_rows = []
-
-    # Loop over df1 rows
-    for id1, row1 in df1.iterrows():
-        fig_id = str(row1['Figure ID'])
-        fig_label = str(row1['Figure Label'])
-
-        # Filter df2 for rows where either fig_id or fig_label is a substring 
-        matches = df2[df2['Sentences'].str.contains(fig_id, na=False) | df2['Sentences'].str.contains(fig_label, na=False)]
-
-        if not matches.empty:
-            for _, row2 in matches.iterrows():
-                # Append the merged row to the list
-                merged_row = row1.to_dict()
-                merged_row['Spacy Extracted Text'] = row2['Sentences']
-                merged_rows.append(merged_row)
+    df1 = pac.read_csv(df1_path, parse_options=_TSV_PARSE_OPTIONS, convert_options=_TSV_CONVERT_OPTIONS).to_pandas()
+    # Only the sentences are needed from the spacy output
+    df2 = pac.read_csv(df2_path, parse_options=_TSV_PARSE_OPTIONS, convert_options=_SENTENCES_CONVERT_OPTIONS).to_pandas()
+
+    # A missing figure ID or label becomes an empty key, which never matches a sentence
+    fig_ids = df1['Figure ID'].fillna('').astype(str).tolist()
+    fig_labels = df1['Figure Label'].fillna('').astype(str).tolist()
+    sentences = df2['Sentences'].tolist()
+
+    # Find every figure ID and label that is a substring of each sentence in one pass over the sentences,
+    # building an index from each ID or label to the df2 rows that contain it
+    automaton = ahocorasick.Automaton()
+    for key in set(fig_ids) | set(fig_labels):
+        if key:
+            automaton.add_word(key, key)
+    automaton.make_automaton()
+
+    rows_by_key = {}
+    # An automaton without keys cannot be searched, and nothing could match anyway
+    for row2, sentence in enumerate(sentences if len(automaton) else ()):
+        if not isinstance(sentence, str):
+            continue
+        for key in {key for _, key in automaton.iter(sentence)}:
+            rows_by_key.setdefault(key, []).append(row2)
+
+    # Pair each df1 row with the df2 rows whose sentences contain its figure ID or label, in df2 order.
+    # df1 rows with no match are kept with no extracted text.
+    rows1, texts = [], []
+    for row1, (fig_id, fig_label) in enumerate(zip(fig_ids, fig_labels)):
+        matches = sorted(set(rows_by_key.get(fig_id, ())) | set(rows_by_key.get(fig_label, ())))
+        if matches:
+            rows1.extend([row1] * len(matches))
+            texts.extend(sentences[row2] for row2 in matches)
         else:
-            # Optional: include df1 rows with no match
-            merged_row = row1.to_dict()
-            merged_row['Spacy Extracted Text'] = None
-            merged_rows.append(merged_row)
+            rows1.append(row1)
+            texts.append(None)
 
-    # Convert the result to a new DataFrame
-    df_combined = pd.DataFrame(merged_rows)
+    df_combined = df1.iloc[rows1].reset_index(drop=True)
+    df_combined['Spacy Extracted Text'] = texts
     df_combined.to_csv(df_combined_path, sep="\t")
     print(f"Dataframes combined: {df_combined_path}")
 
@@ -409,35 +765,23 @@ def clean_text(download_path):
     :param download_path: the figure_data.tsv within this directory will be cleaned.
     :return: a cleaned .tsv file
     """
-    def simple_clean_text(text):
-        text = str(text).replace('\xa0', ' ') 
-        text = re.sub(r'[^\S\t]+', ' ', text)
-        return text.strip()
-
-    def clean_latex_text(text):
-        text = re.sub(r'\\(?:documentclass\[[^\]]*\]\{[^\}]*\}|usepackage\{[^\}]*\}|setlength\{[^\}]*\}|begin\{[^\}]*\}|end\{[^\}]*\}|[a-zA-Z]+\{[^\}]*\})', '', text)
-        text = re.sub(r'(\$[^\$]*\$|\\\([^\)]*\\\))', lambda m: m.group(0), text)
-        return text.strip()
-    
-    def clean_spacy_text(text):
-        text = re.sub(r'\((?:[A-Za-z\s\.\-]+(?:,|\set\sal\.,?|\sand\s[A-Za-z\s\.\-]+,?)\s?\d{4}(?:;?\s?)?)+\)', '', text)
-        return text.strip()
-
     df_path = os.path.join(download_path, "combined_figure_data.tsv")
     output_path = os.path.join(download_path, "combined_cleaned_data.tsv")
-    df = pd.read_csv(df_path, sep="\t")
+    df = pac.read_csv(df_path, parse_options=_TSV_PARSE_OPTIONS, convert_options=_TSV_CONVERT_OPTIONS).to_pandas()
     df['Spacy Extracted Text'] = df['Spacy Extracted Text'].fillna('').astype(str)
     merged_df = df.groupby(['PMC ID', 'Figure ID', 'Figure Label', 'Associated Image File', 'Sentences Before', 'Sentences After', 'Caption Title', 'Caption Text'], as_index=False).agg({'Spacy Extracted Text': ' '.join})
     text_cols = ('Sentences Before', 'Sentences After', 'Caption Title', 'Caption Text', 'Spacy Extracted Text')
     for col in text_cols:
-        merged_df[col] = merged_df[col].map(simple_clean_text)
-        merged_df[col] = merged_df[col].map(clean_latex_text)
-        merged_df[col] = merged_df[col].map(clean_spacy_text)
+        merged_df[col] = (merged_df[col].astype(str)
+            .str.replace(_CLEAN_RE, _clean_match, regex=True)
+            .str.replace(_CITATION_RE, '', regex=True).str.strip())
 
 
     print(f"{df_path} has been cleaned.")
 
-    merged_df.to_csv(output_path, sep="\t")
+    # Keep the row number as the unnamed first column, as DataFrame.to_csv wrote it
+    table = pa.Table.from_pandas(merged_df.reset_index(names=""), preserve_index=False)
+    pac.write_csv(table, output_path, write_options=_TSV_WRITE_OPTIONS)
     print(f"Cleaned csv saved to {output_path}")
 
 def file_shuttle(download_path):
@@ -447,11 +791,23 @@ def file_shuttle(download_path):
     source_path = os.path.join(download_path, "Sorted")
     destination_path = download_path
 
-    for dir in os.listdir(source_path):
-        full_in_path = os.path.join(source_path, dir)
-        full_out_path = os.path.join(destination_path, dir)
-        shutil.move(full_in_path, full_out_path)
-        print(f"Folder {dir} moved to {full_out_path}")
+    def move(entry):
+        full_out_path = os.path.join(destination_path, entry.name)
+        _move(entry.path, full_out_path)
+        print(f"Folder {entry.name} moved to {full_out_path}")
+
+    with os.scandir(source_path) as scan:
+        entries = list(scan)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(move, entries))
+
+def _extension(name):
+    """
+    Returns the extension of a file name including its dot, as os.path.splitext does. Names without a dot, or
+    whose only dots are leading ones (such as ".hidden"), have no extension.
+    """
+    stem, dot, ext = name.rpartition(".")
+    return dot + ext if stem.strip(".") else ""
 
 def remove_file_type(download_path, extensions):
     """
@@ -459,26 +815,22 @@ def remove_file_type(download_path, extensions):
     :param input_folderpath: string. Input the folder with subdirectories to remove files from
     :param extensions: string. the file type to remove. can accept single arguments or a list of arguments.
     """
-
-    all_contents = os.listdir(download_path)
-    for item in all_contents:
-        item_path = os.path.join(download_path, item)
-        if os.path.isdir(item_path):
-            files = os.listdir(item_path)
-            for file in files: 
-                print(f"Processing {file}")
-                file_path = os.path.join(item_path, file)
-                ext = os.path.splitext(file_path)
-                ext_txt = str(ext[1])
-              
-                for extension in extensions:
-                    if ext_txt == extension:
-                        os.remove(file_path)
-                        print(f"Deleted {file_path}")
-                    else:
-                        pass
-        else:
-            pass
+    # A single extension string would otherwise be iterated character by character
+    extensions = {extensions} if isinstance(extensions, str) else set(extensions)
+
+    with os.scandir(download_path) as items:
+        for item in items:
+            if item.is_dir(follow_symlinks=False):
+                with os.scandir(item.path) as files:
+                    for file in files: 
+                        if not file.is_file(follow_symlinks=False):
+                            continue # skips subdirectories
+                        print(f"Processing {file.name}")
+                        if _extension(file.name) in extensions:
+                            os.remove(file.path)
+                            print(f"Deleted {file.path}")
+            else:
+                pass
         
 def unique_exts(download_path):
     """
@@ -486,27 +838,37 @@ def unique_exts(download_path):
     :param download_path: string. Input the folder with subdirectories to remove gifs from
     """
 
-    all_contents = os.listdir(download_path)
-    for item in all_contents:
-        unique_exts= []
-        item_path = os.path.join(download_path, item)
-        if os.path.isdir(item_path):
-
-            files = os.listdir(item_path)
-            for file in files: 
-                
-                file_path = os.path.join(item_path, file)
-                ext = os.path.splitext(file_path)
-                ext_txt = str(ext[1])
-                if ext_txt not in unique_exts:
-                    unique_exts.append(ext_txt)
-                
-        else:
-            pass
-        
-        print(f"The unique extensions in folder {item} are {unique_exts}") 
-        if ".pdf" not in unique_exts:
-            print(f"WARNING: {item} DOES NOT CONTAIN PDF FILE")      
+    with os.scandir(download_path) as items:
+        for item in items:
+            unique_exts= []
+            if item.is_dir(follow_symlinks=False):
+                with os.scandir(item.path) as files:
+                    # dict keys keep the first-seen order of a list with constant-time membership checks
+                    unique_exts = list(dict.fromkeys(_extension(file.name) for file in files))
+                    
+            else:
+                pass
+            
+            print(f"The unique extensions in folder {item.name} are {unique_exts}") 
+            if ".pdf" not in unique_exts:
+                print(f"WARNING: {item.name} DOES NOT CONTAIN PDF FILE")      
+
+def _rmtree_parallel(folders, max_workers=16):
+    """
+    Removes each folder and everything inside it. Subfolders are removed on a thread pool first,
+    since the unlink and rmdir calls behind shutil.rmtree release the GIL.
+    :param folders: list of folder paths to remove.
+    """
+    subfolders = []
+    for folder in folders:
+        with os.scandir(folder) as entries:
+            subfolders.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(shutil.rmtree, subfolders))
+
+    for folder in folders:
+        shutil.rmtree(folder)
 
 def no_trace(download_path):
     """
@@ -515,9 +877,136 @@ def no_trace(download_path):
     """
     uncompressed_folder = os.path.join(download_path, "Uncompressed")
     sorted_folder = os.path.join(download_path, "Sorted")
-    try:
-        shutil.rmtree(uncompressed_folder)
-        shutil.rmtree(sorted_folder)
-    except FileNotFoundError:
+    folders = [folder for folder in (uncompressed_folder, sorted_folder) if os.path.isdir(folder)]
+    if len(folders) < 2:
         print("Folder to remove not found.")
-    print("Poof! All intermediate files generated by this pipeline have been erased.")
\ No newline at end of file
+    _rmtree_parallel(folders)
+    print("Poof! All intermediate files generated by this pipeline have been erased.")
+
+def run_pipeline(dir, subdir, download_path, extensions=(".gif", ".doc", ".docx", ".html", ".mov"), max_workers=8,
+                 parse_workers=None):
+    """
+    Runs the full pipeline on one PMC directory. Downloading, uncompressing and parsing overlap: each archive is
+    extracted as soon as it has been downloaded, and each record is parsed as soon as it has been extracted.
+    The remaining steps run once every record has been parsed.
+    :params dir and subdir: the PMC directory to process, as for download_pmc.
+    :param download_path: folder where records are downloaded and output files are written.
+    :param extensions: file types removed from the records once processing is complete, as for remove_file_type.
+    :param max_workers: number of HTTPS connections used to download files in parallel.
+    :param parse_workers: number of processes used to parse records in parallel. Defaults to the number of CPUs.
+    """
+    directory_url = f"{_PMC_URL}/{dir}/{subdir}/"
+    uncompressed_filepath = os.path.join(download_path, "Uncompressed")
+    os.makedirs(uncompressed_filepath, exist_ok=True)
+
+    session = _pmc_session(max_workers)
+    files = _list_archives(session, directory_url)
+    print(f"Found {len(files)} files. Starting download...")
+
+    # Bounded queues between stages, so downloads pause when extraction falls behind.
+    # None tells the next stage that no more items are coming.
+    untar_workers = os.cpu_count() or 1
+    archive_queue = queue.Queue(maxsize=16)
+    record_queue = queue.Queue(maxsize=16)
+    # Set once parsing has stopped, so the other stages skip their remaining work instead of waiting on it
+    stop = threading.Event()
+
+    def download(file):
+        if stop.is_set():
+            return
+        downloaded_file_path = os.path.join(download_path, file)
+        _download_file(session, directory_url + file, downloaded_file_path)
+        print(f"Downloaded: {file}")
+        archive_queue.put(downloaded_file_path)
+
+    def download_all():
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(download, files))
+            print(f"Directory {dir}/{subdir} downloaded successfully!")
+        finally:
+            session.close()
+            for _ in range(untar_workers):
+                archive_queue.put(None)
+
+    def untar():
+        while (compressed_filepath := archive_queue.get()) is not None:
+            if stop.is_set():
+                continue
+            item = os.path.basename(compressed_filepath)
+            try:
+                if os.path.getsize(compressed_filepath) == 0:
+                    os.remove(compressed_filepath) # Removes empty files
+                    continue
+                names = _extract_tar(compressed_filepath, uncompressed_filepath)
+                if names is None:
+                    print("Corrupted tar archive. Moving to next file.")
+                    continue
+                print(f'{item} has been uncompressed succesfully.')
+                os.remove(compressed_filepath)
+                print(f'{item} archive has been removed.')
+            except OSError as error:
+                print(f"Warning: could not uncompress {item} ({error}). Moving to next file.")
+                continue
+            for name in names:
+                record_queue.put(name)
+
+    def untar_all():
+        # The system tar runs in its own process, so threads are enough to extract archives in parallel
+        try:
+            with ThreadPoolExecutor(max_workers=untar_workers) as executor:
+                for future in [executor.submit(untar) for _ in range(untar_workers)]:
+                    future.result()
+        finally:
+            record_queue.put(None)
+
+    def parsed_records(executor):
+        # Records are parsed as they arrive, and yielded in arrival order as soon as they are ready
+        pending = deque()
+        while (name := record_queue.get()) is not None:
+            record_id = _pmc_id(name)
+            record_path = os.path.join(uncompressed_filepath, name)
+            if not record_id or not os.path.isdir(record_path):
+                continue  # Skip if record ID is not found
+            with os.scandir(record_path) as entries:
+                file_list = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+            pending.append((record_id, executor.submit(_process_record, record_path, record_id, file_list)))
+            while pending and pending[0][1].done():
+                record_id, future = pending.popleft()
+                yield record_id, future.result()
+        for record_id, future in pending:
+            yield record_id, future.result()
+
+        # Download and extraction errors are raised before any record is sorted
+        download_stage.result()
+        untar_stage.result()
+
+    with ThreadPoolExecutor(max_workers=2) as stages:
+        download_stage = stages.submit(download_all)
+        untar_stage = stages.submit(untar_all)
+
+        # Workers are started by a server process rather than forked from this one: a fork taken while the
+        # stage threads are inside subprocess.run can leave the child holding their locks and hang
+        mp_context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=parse_workers, mp_context=mp_context) as executor:
+                _write_and_sort_records(download_path, parsed_records(executor))
+        finally:
+            # If parsing failed, keep draining records until extraction has finished, so no stage is left
+            # blocked on a full queue
+            stop.set()
+            while not untar_stage.done():
+                try:
+                    record_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    grab_spacy_text(download_path)
+    combine_dataframes(download_path)
+    clean_text(download_path)
+
+    file_shuttle(download_path)
+    remove_file_type(download_path, extensions)
+    unique_exts(download_path)
+    no_trace(download_path)
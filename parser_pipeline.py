@@ -5,23 +5,8 @@ import re
 
 download_path = "/Users/rachel/Desktop/xml_parser_test"
 
-# Step 1. Download folder contents
-f.download_pmc("00", "00", download_path)
-
-# Step 2. Uncompress archives 
-f.uncompress_tar(download_path)
-
-# Step 3. Sort viable records
-f.sort_data(download_path)
-
-# Step 4. Parse Sorted Records
-f.grab_figure_data(download_path)
-f.grab_spacy_text(download_path)
-f.combine_dataframes(download_path)
-f.clean_text(download_path)
-
-# Step 5. Clean up
-f.file_shuttle(download_path)
-f.remove_file_type(download_path, extensions=(".gif", ".doc", ".docx", ".html", ".mov"))
-f.unique_exts(download_path) 
-f.no_trace(download_path)
+# Worker processes started with spawn (the macOS default) re-import this script, so the pipeline only runs when executed directly
+if __name__ == "__main__":
+    # Steps 1-3 (download, uncompress, sort and parse records) overlap, followed by step 4 (spacy text,
+    # combining and cleaning) and step 5 (clean up). See run_pipeline in functions.py.
+    f.run_pipeline("00", "00", download_path, extensions=(".gif", ".doc", ".docx", ".html", ".mov"))